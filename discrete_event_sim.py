@@ -1,5 +1,6 @@
 import logging
 import heapq
+import itertools
 # TODO: implement the event queue!
 # suggestion: have a look at the heapq library (https://docs.python.org/dev/library/heapq.html)
 # and in particular heappush and heappop
@@ -18,18 +19,20 @@ class Simulation:
 
         self.t = 0  # simulated time
         self.events = [] # +TODO: set up self.events as an empty queue
+        # insertion counter: events scheduled at the same time are processed in the order they were scheduled
+        self._counter = itertools.count()
 
     def schedule(self, delay, event):
         """Add an event to the event queue after the required delay."""
 
         # +TODO: add event to the queue at time self.t + delay
-        heapq.heappush(self.events, (self.t + delay, event))
+        heapq.heappush(self.events, (self.t + delay, next(self._counter), event))
 
     def run(self, max_t=float('inf')):
         """Run the simulation. If max_t is specified, stop it at that time."""
 
         while self.events:  # +TODO: as long as the event queue is not empty:
-            t, event = heapq.heappop(self.events) # +TODO: get the first event from the queue
+            t, _, event = heapq.heappop(self.events) # +TODO: get the first event from the queue
             if t > max_t:
                 break
             self.t = t
@@ -48,8 +51,3 @@ class Event:
 
     def process(self, sim: Simulation):
         raise NotImplementedError
-
-    def __lt__(self, other):
-        """Method needed to break ties with events happening at the same time."""
-
-        return id(self) < id(other)
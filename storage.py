@@ -4,8 +4,10 @@ import argparse
 import configparser
 import logging
 import random
-from dataclasses import dataclass
-from random import expovariate
+from collections import Counter
+from dataclasses import dataclass, field
+from math import log as _log
+from random import random as _random
 from typing import Optional, List
 
 # the humanfriendly library (https://humanfriendly.readthedocs.io/en/latest/) lets us pass parameters in human-readable
@@ -18,8 +20,11 @@ from discrete_event_sim import Simulation, Event
 
 
 def exp_rv(mean):
-    """Return an exponential random variable with the given mean."""
-    return expovariate(1 / mean)
+    """Return an exponential random variable with the given mean.
+
+    Same as `expovariate(1 / mean)`, inlined since it's called for every scheduled node event.
+    """
+    return -mean * _log(1.0 - _random())
 
 
 class DataLost(Exception):
@@ -44,6 +49,14 @@ class Backup(Simulation):
         self.total_recovery_time = 0.0  # суммируем по всем успешным восстановлению
         self.recovery_start_times = {}  # по node.id храним время начала восстановления
 
+        # online nodes that are not uploading (idle_up) / not downloading (idle_down) anything;
+        # dicts with None values are used as insertion-ordered sets, to keep runs with the same seed repeatable
+        self.idle_up: dict[Node, None] = {}
+        self.idle_down: dict[Node, None] = {}
+
+        # whether info messages are output; checked before building per-event log messages
+        self._log_enabled = logging.getLogger().isEnabledFor(logging.INFO)
+
         # we add to the event queue the first event of each node going online and of failing
         for node in nodes:
             # we plan to make the node go online at its arrival time
@@ -83,30 +96,37 @@ class Backup(Simulation):
         # update the status of the uploader and downloader: they are busy now
         downloader.current_download = event
         uploader.current_upload = event
+        del self.idle_down[downloader]
+        del self.idle_up[uploader]
 
 
     def summary(self):
-        total_data_loss_events = sum(n.total_data_loss_events for n in self.nodes)
-        total_data_recovered = sum(n.total_data_recovered for n in self.nodes)
-        total_backups = sum(n.total_backups_made for n in self.nodes)
-        total_restores = sum(n.total_restores_made for n in self.nodes)
-
-        vulnerable_blocks = 0
-        total_blocks = 0
+        # owner_counts[n] is the number of nodes holding at least one block of n, computed in a single pass
+        owner_counts = Counter()
+        for other in self.nodes:
+            owner_counts.update(other.remote_blocks_held.keys())
+
+        # accumulate all the per-node totals in a single sweep
+        total_data_loss_events = total_data_recovered = total_backups = total_restores = 0
+        total_blocks = nodes_with_failure = vulnerable_blocks = 0
         for n in self.nodes:
+            total_data_loss_events += n.total_data_loss_events
+            total_data_recovered += n.total_data_recovered
+            total_backups += n.total_backups_made
+            total_restores += n.total_restores_made
             total_blocks += n.n
+            if n.total_data_loss_events > 0:
+                nodes_with_failure += 1
             for peer in n.backed_up_blocks:
                 if peer is not None:
-                    # SUM
-                    owners = sum(1 for other in self.nodes if n in other.remote_blocks_held)
-                    if owners == 1:
+                    if owner_counts.get(n, 0) == 1:
                         #if the block is backed up only on a remote node we add it to the vulnerable blocks
                         vulnerable_blocks += 1
 
         # percent of the restored data
         percent_restored = 100 * total_data_recovered / total_data_loss_events if total_data_loss_events else 100
         # percent of nodes that experienced at least one failure
-        percent_nodes_failed = 100 * sum(1 for n in self.nodes if n.total_data_loss_events > 0) / len(self.nodes)
+        percent_nodes_failed = 100 * nodes_with_failure / len(self.nodes)
 
         print("\nSummary of the simulation:")
         print(f"Simulated time: {format_timespan(self.t)}")
@@ -122,12 +142,18 @@ class Backup(Simulation):
 
 
     def log_info(self, msg):
-        """Override method to get human-friendly logging for time."""
+        """Override method to get human-friendly logging for time.
+
+        The time is only formatted if info messages are actually output.
+        """
 
-        logging.info(f'{format_timespan(self.t)}: {msg}')
+        if self._log_enabled:
+            logging.info('%s: %s', format_timespan(self.t), msg)
 
 
-@dataclass(eq=False)  # auto initialization from parameters below (won't consider two nodes with same state as equal)
+# auto initialization from parameters below (won't consider two nodes with same state as equal);
+# with slots=True attributes are stored in fixed slots rather than in a per-instance __dict__
+@dataclass(eq=False, slots=True)
 class Node:
     """Class representing the configuration of a given node."""
 
@@ -157,56 +183,86 @@ class Node:
 
     arrival_time: float  # time at which the node will come online
 
+    # state set up in __post_init__: declared here so that each attribute gets its slot
+    _hash: int = field(init=False, repr=False)
+    online: bool = field(init=False, repr=False)
+    failed: bool = field(init=False, repr=False)
+    block_size: int = field(init=False, repr=False)
+    free_space: int = field(init=False, repr=False)
+    local_blocks: bytearray = field(init=False, repr=False)
+    local_blocks_count: int = field(init=False, repr=False)
+    backed_up_blocks: list[Optional['Node']] = field(init=False, repr=False)
+    backed_up_count: int = field(init=False, repr=False)
+    remote_owners: set['Node'] = field(init=False, repr=False)
+    backed_up_counts: dict['Node', int] = field(init=False, repr=False)
+    unbacked_blocks: set[int] = field(init=False, repr=False)
+    remote_blocks_held: dict['Node', int] = field(init=False, repr=False)
+    needy_peers: dict['Node', int] = field(init=False, repr=False)
+    current_upload: Optional['TransferComplete'] = field(init=False, repr=False)
+    current_download: Optional['TransferComplete'] = field(init=False, repr=False)
+    total_data_loss_events: int = field(init=False, repr=False)
+    total_data_recovered: int = field(init=False, repr=False)
+    total_backups_made: int = field(init=False, repr=False)
+    total_restores_made: int = field(init=False, repr=False)
+
     def __post_init__(self):
         """Compute other data dependent on config values and set up initial state."""
 
+        # hash value returned by __hash__, computed once since nodes are used as set items and dict keys everywhere
+        self._hash = id(self)
+
         # whether this node is online. All nodes start offline.
-        self.online: bool = False
+        self.online = False
 
         # whether this node is currently under repairs. All nodes are ok at start.
-        self.failed: bool = False
+        self.failed = False
 
         # size of each block
-        self.block_size: int = self.data_size // self.k if self.k > 0 else 0
+        self.block_size = self.data_size // self.k if self.k > 0 else 0
 
         # amount of free space for others' data -- note we always leave enough space for our n blocks
-        self.free_space: int = self.storage_size - self.block_size * self.n
+        self.free_space = self.storage_size - self.block_size * self.n
 
         assert self.free_space >= 0, "Node without enough space to hold its own data"
 
-        # local_blocks[block_id] is true if we locally have the local block
-        # [x] * n is a list with n references to the object x
-        self.local_blocks: list[bool] = [True] * self.n
+        # local_blocks[block_id] is 1 if we locally have the local block, 0 otherwise;
+        # a bytearray uses one byte per block and is reset without building a list of Python objects
+        self.local_blocks = bytearray(b'\x01' * self.n)
+        # number of non-zero entries in local_blocks, kept up to date incrementally
+        self.local_blocks_count = self.n
 
         # backed_up_blocks[block_id] is the peer we're storing that block on, or None if it's not backed up yet;
         # we start with no blocks backed up
-        self.backed_up_blocks: list[Optional[Node]] = [None] * self.n
+        self.backed_up_blocks = [None] * self.n
+        # number of non-None entries in backed_up_blocks, kept up to date incrementally
+        self.backed_up_count = 0
+        # peers holding at least one of our blocks, and how many blocks each of them holds
+        self.remote_owners = set()
+        self.backed_up_counts = {}
+        # ids of the blocks we hold locally but are not backed up yet (all of them at start)
+        self.unbacked_blocks = set(range(self.n))
 
         # (owner -> block_id) mapping for remote blocks stored
-        self.remote_blocks_held: dict[Node, int] = {}
+        self.remote_blocks_held = {}
+        # subset of remote_blocks_held: the owners that lost the block we hold for them and need it restored
+        self.needy_peers = {}
 
         # current uploads and downloads, stored as a reference to the relative TransferComplete event
-        self.current_upload: Optional[TransferComplete] = None
-        self.current_download: Optional[TransferComplete] = None
+        self.current_upload = None
+        self.current_download = None
 
         # for Summary()
-        self.total_data_loss_events: int = 0  # how many times data was lost Fail.process()
-        self.total_data_recovered: int = 0    # how many times data was recovered BlockRestoreComplete.update_block_state()
-        self.total_backups_made: int = 0      # how many blocks were backed up BlockBackupComplete.update_block_state()
-        self.total_restores_made: int = 0     # how many blocks were restored BlockRestoreComplete.update_block_state()
+        self.total_data_loss_events = 0  # how many times data was lost Fail.process()
+        self.total_data_recovered = 0    # how many times data was recovered BlockRestoreComplete.update_block_state()
+        self.total_backups_made = 0      # how many blocks were backed up BlockBackupComplete.update_block_state()
+        self.total_restores_made = 0     # how many blocks were restored BlockRestoreComplete.update_block_state()
 
 
     def find_block_to_back_up(self): # +TODO
         """Returns the block id of a block that needs backing up, or None if there are none."""
 
-        # find a block that we have locally but not remotely
-        # check `enumerate` and `zip` at https://docs.python.org/3/library/functions.html
-        for block_id, (held_locally, peer) in enumerate(zip(self.local_blocks, self.backed_up_blocks)):
-           # held_locally - our block is on our node # +TODO
-           # peer - the block is backed up on a remote node # +TODO
-           if held_locally and peer is None:
-                return block_id # return the block we need to back up
-        return None 
+        # any block that we have locally but not remotely
+        return next(iter(self.unbacked_blocks), None)
 
     def schedule_next_upload(self, sim: Backup):
         """Schedule the next upload, if any."""
@@ -216,15 +272,19 @@ class Node:
         # we don't want to upload if we're already uploading something
         if self.current_upload is not None:
             return
+        # nothing to restore to others and nothing of ours to back up: no need to look for peers
+        if not self.needy_peers and not self.unbacked_blocks:
+            return
 
         #  1. first find if we have a backup that a remote node needs
-        for peer, block_id in self.remote_blocks_held.items():
-            # peer.online - if the remote peer is online\
-            # peer.current_download is None - if the remote peer is not downloading anything
-            # not peer.local_blocks[block_id] - if the remote peer does not have his block locally
-            if peer.online and peer.current_download is None and not peer.local_blocks[block_id]: # +TODO
-                sim.schedule_transfer(self, peer, block_id, restore=True)                       # +TODO
-                return  # it means that that peer lost the block and we are uploading it to him
+        # (needy_peers only contains the peers that do not have their block locally)
+        if self.needy_peers:
+            # sim.idle_down holds the peers that are online and not downloading anything
+            idle_down = sim.idle_down
+            for peer, block_id in self.needy_peers.items():
+                if peer in idle_down: # +TODO
+                    sim.schedule_transfer(self, peer, block_id, restore=True)                       # +TODO
+                    return  # it means that that peer lost the block and we are uploading it to him
 
         # 2. if other nodes do not require repair, 
         # we look for our own blocks which are not backed up yet
@@ -232,16 +292,21 @@ class Node:
         if block_id is None:
             return
         
-        # 3. collecting the nodes that have at least one our block backed up
-        remote_owners = set(node for node in self.backed_up_blocks if node is not None)  # nodes having one block
-        for peer in sim.nodes:
-        # 4. we look for a node:
-        # if the peer is not self, is online, is not among the remote owners, has enough space and is not
-        # downloading anything currently, schedule the backup of block_id from self to peer
-            if (peer is not self and peer.online and peer not in remote_owners and peer.current_download is None # +TODO
-                    and peer.free_space >= self.block_size):                                                    # +TODO
-                sim.schedule_transfer(self, peer, block_id, restore=False)                                    # +TODO
-                return
+        # 3. the nodes that have at least one our block backed up
+        remote_owners = self.remote_owners
+        block_size = self.block_size  # local binding, read once instead of at every iteration
+        # 4. we look for a node among the online ones that are not downloading anything:
+        # if the peer is not self, is not among the remote owners and has enough space,
+        # schedule the backup of block_id from self to peer (cheapest tests first)
+        for peer in sim.idle_down:
+            if peer is self:
+                continue
+            if peer in remote_owners:
+                continue
+            if peer.free_space < block_size:
+                continue
+            sim.schedule_transfer(self, peer, block_id, restore=False)  # +TODO
+            return
 
     def schedule_next_download(self, sim: Backup):
         """Schedule the next download, if any."""
@@ -253,28 +318,36 @@ class Node:
             return
 
         # 1. find if we have a block which is on a remote node and not on our node
-        for block_id, (held_locally, peer) in enumerate(zip(self.local_blocks, self.backed_up_blocks)):
-            if not held_locally and peer is not None and peer.online and peer.current_upload is None:  # +TODO
-                sim.schedule_transfer(peer, self, block_id, restore=True)                           # +TODO
-                return  # it means that we are downloading the block from the remote peer
-
-        # 2. we look for a node
-        for peer in sim.nodes:
-            # if the peer is not self, is online, has no current upload, is not among the remote owners,
-            # has enough space and is not downloading anything currently, schedule the backup of block_id from self to peer
-            if (peer is not self and peer.online and peer.current_upload is None and peer not in self.remote_blocks_held # +TODO
-                    and self.free_space >= peer.block_size):                                                # +TODO                                     
-                block_id = peer.find_block_to_back_up()
-                if block_id is not None:
-                    sim.schedule_transfer(peer, self, block_id, restore=False)                               # +TODO
-                    return
+        # (only if some block is missing locally)
+        if self.local_blocks_count < self.n:
+            for block_id, (held_locally, peer) in enumerate(zip(self.local_blocks, self.backed_up_blocks)):
+                if not held_locally and peer is not None and peer.online and peer.current_upload is None:  # +TODO
+                    sim.schedule_transfer(peer, self, block_id, restore=True)                           # +TODO
+                    return  # it means that we are downloading the block from the remote peer
+
+        # 2. we look for a node among the online ones that are not uploading anything:
+        # if the peer is not self, is not among the remote owners and we have enough space for its blocks,
+        # schedule the backup of one of its blocks from peer to self (cheapest tests first)
+        remote_blocks_held = self.remote_blocks_held
+        free_space = self.free_space
+        for peer in sim.idle_up:
+            if peer is self:
+                continue
+            if peer in remote_blocks_held:
+                continue
+            if free_space < peer.block_size:
+                continue
+            block_id = peer.find_block_to_back_up()
+            if block_id is not None:
+                sim.schedule_transfer(peer, self, block_id, restore=False)  # +TODO
+                return
 
     def __hash__(self):
         """Function that allows us to have `Node`s as dictionary keys or set items.
 
         With this implementation, each node is only equal to itself.
         """
-        return id(self)
+        return self._hash
 
     def __str__(self):
         """Function that will be called when converting this to a string (e.g., when logging or printing)."""
@@ -303,6 +376,8 @@ class Online(NodeEvent):
             return
         # otherwise set the node as online
         node.online = True
+        sim.idle_up[node] = None
+        sim.idle_down[node] = None
         # the node looks for which blocks are possible to back up
         # and which blocks are possible to download
         node.schedule_next_upload(sim) # class Node # +TODO
@@ -330,10 +405,12 @@ class Disconnection(NodeEvent):
         """Must be implemented by subclasses"""
         raise NotImplementedError
 
-    def disconnect(self):
+    def disconnect(self, sim: Backup):
         node = self.node
         # 1. set the node as offline
         node.online = False
+        sim.idle_up.pop(node, None)
+        sim.idle_down.pop(node, None)
         # cancel current upload and download
         # retrieve the nodes we're uploading and downloading to 
         # and set their current downloads and uploads to None
@@ -344,14 +421,19 @@ class Disconnection(NodeEvent):
         if current_upload is not None:
             current_upload.canceled = True
             current_upload.downloader.current_download = None
+            sim.idle_down[current_upload.downloader] = None
             node.current_upload = None
+            # the canceled event stays in the queue until its time: drop its references to the nodes
+            current_upload.uploader = current_upload.downloader = None
         # 3. if the node was downloading something:
         # set downloading as False, remove link on the remote uploader,
         # remove link on the downloader (the node)
         if current_download is not None:
             current_download.canceled = True
             current_download.uploader.current_upload = None
+            sim.idle_up[current_download.uploader] = None
             node.current_download = None
+            current_download.uploader = current_download.downloader = None
 
 
 class Offline(Disconnection):
@@ -364,7 +446,7 @@ class Offline(Disconnection):
             return
         assert node.online
         # if the node is online, set it as offline
-        self.disconnect() # from the parent class Disconnection
+        self.disconnect(sim) # from the parent class Disconnection
         # schedule when the node will be back online
         sim.schedule(exp_rv(self.node.average_downtime), Online(node))
 
@@ -374,7 +456,7 @@ class Fail(Disconnection):
 
     def process(self, sim: Backup):
         sim.log_info(f"{self.node} fails")
-        self.disconnect()
+        self.disconnect(sim)
         node = self.node
         node.failed = True
 
@@ -383,25 +465,35 @@ class Fail(Disconnection):
 
 
         # all the local data is lost
-        node.local_blocks = [False] * node.n  # lose all local data
+        node.local_blocks = bytearray(node.n)  # lose all local data
+        node.local_blocks_count = 0
+        node.unbacked_blocks.clear()  # no block is available locally to be backed up
+        # the peers holding our blocks now have to restore them to us
+        for block_id, peer in enumerate(node.backed_up_blocks):
+            if peer is not None:
+                peer.needy_peers[node] = block_id
         # all the remote blocks which were held on this node are lost
         for owner, block_id in node.remote_blocks_held.items():
             owner.backed_up_blocks[block_id] = None
+            owner.backed_up_count -= 1
+            if owner.local_blocks[block_id]:
+                owner.unbacked_blocks.add(block_id)  # the owner has to back it up again
+            count = owner.backed_up_counts[node] - 1
+            if count == 0:
+                owner.remote_owners.discard(node)
+                del owner.backed_up_counts[node]
+            else:
+                owner.backed_up_counts[node] = count
             # if the owner is online and has no current upload, schedule the next upload to other nodes
             if owner.online and owner.current_upload is None:
                 owner.schedule_next_upload(sim)  # this node may want to back up the missing block
         # clean info about the remote blocks held on this node
         node.remote_blocks_held.clear()
+        node.needy_peers.clear()
         # set the free space to the storage size of this node
         node.free_space = node.storage_size - node.block_size * node.n
         # schedule the next online and recover events
         recover_time = exp_rv(node.average_recover_time)
-        # в Fail.handle()
-        #self.node.local_blocks = [False] * self.node.n
-        #self.node.total_data_loss_events += 1
-        node.local_blocks = [False] * self.node.n
-        node.total_data_loss_events += 1
-
         # schedule the recovery event of this node in a random exponentioal time
         sim.schedule(recover_time, Recover(node))
 
@@ -410,8 +502,9 @@ class Fail(Disconnection):
 class TransferComplete(Event):
     """An upload is completed."""
 
-    uploader: Node
-    downloader: Node
+    # both set to None when the transfer is canceled
+    uploader: Optional[Node]
+    downloader: Optional[Node]
     block_id: int
     # was the transfer canceled
     canceled: bool = False
@@ -420,9 +513,11 @@ class TransferComplete(Event):
         assert self.uploader is not self.downloader
 
     def process(self, sim: Backup):
-        sim.log_info(f"{self.__class__.__name__} from {self.uploader} to {self.downloader}")
         if self.canceled:
             return  # this transfer was canceled, so ignore this event
+        log_enabled = sim._log_enabled
+        if log_enabled:
+            sim.log_info(f"{self.__class__.__name__} from {self.uploader} to {self.downloader}")
         uploader, downloader = self.uploader, self.downloader
         assert uploader.online and downloader.online
         # it updates the state of the uploader and downloader
@@ -430,14 +525,17 @@ class TransferComplete(Event):
         self.update_block_state()
         downloader.current_download = None
         uploader.current_upload = None
+        sim.idle_down[downloader] = None
+        sim.idle_up[uploader] = None
         # plan the next upload and download of the uploader and downloader nodes
         uploader.schedule_next_upload(sim)
         downloader.schedule_next_download(sim)
-        # log the state of the nodes
-        for node in [uploader, downloader]:
-            sim.log_info(f"{node}: {sum(node.local_blocks)} local blocks, "
-                         f"{sum(peer is not None for peer in node.backed_up_blocks)} backed up blocks, "
-                         f"{len(node.remote_blocks_held)} remote blocks held")
+        # log the state of the nodes (skip building the messages entirely if they would be discarded)
+        if log_enabled:
+            for node in (uploader, downloader):
+                sim.log_info(f"{node}: {node.local_blocks_count} local blocks, "
+                             f"{node.backed_up_count} backed up blocks, "
+                             f"{len(node.remote_blocks_held)} remote blocks held")
 
     def update_block_state(self):
         """Needs to be specified by the subclasses, `BackupComplete` and `DownloadComplete`."""
@@ -452,11 +550,15 @@ class BlockBackupComplete(TransferComplete):
         assert peer.free_space >= 0
         # now the owner knows that his block is backed up on the peer
         owner.backed_up_blocks[self.block_id] = peer
+        owner.backed_up_count += 1
+        owner.unbacked_blocks.discard(self.block_id)
+        count = owner.backed_up_counts.get(peer, 0) + 1
+        owner.backed_up_counts[peer] = count
+        if count == 1:
+            owner.remote_owners.add(peer)
         # now the peer knows that he has a block from the owner
         peer.remote_blocks_held[owner] = self.block_id
-
-        owner.backed_up_blocks[self.block_id] = self.downloader
-        owner.total_backups_made += 1 # ???
+        owner.total_backups_made += 1
 
 
 
@@ -464,9 +566,13 @@ class BlockRestoreComplete(TransferComplete):
     def update_block_state(self):
         owner = self.downloader
         # now the owner knows that his block is held locally 
-        owner.local_blocks[self.block_id] = True
+        owner.local_blocks[self.block_id] = 1
+        owner.local_blocks_count += 1
+        # the uploader holds the block for us: we don't need it anymore, and the block is still backed up
+        # there, so it doesn't go back into unbacked_blocks
+        del self.uploader.needy_peers[owner]
         owner.total_restores_made += 1
-        if sum(owner.local_blocks) == owner.k:  # we have exactly k local blocks, we have all of them then
+        if owner.local_blocks_count == owner.k:  # we have exactly k local blocks, we have all of them then
             self.downloader.total_data_recovered += 1        # +TODO
 
 